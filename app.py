@@ -3,44 +3,88 @@
 # pandas
 # plotly
 
+import codecs
+import hashlib
+import hmac
+import io
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.express as px
 
 # ページ設定
 st.set_page_config(page_title="FX Trade Analysis v2", layout="wide")
 
-def load_and_process_data(files):
+def detect_encoding(data):
+    """
+    バイト列の先頭からエンコーディングを判定する
+
+    UTF-8で読んで失敗→cp932で再パースという二度読みを避けるため、
+    BOMと先頭4KBのデコード試行だけで一度で決める。
+    """
+    if data[:3] == b'\xef\xbb\xbf':
+        return 'utf-8-sig'
+    if data[:2] in (b'\xff\xfe', b'\xfe\xff'):
+        return 'utf-16'
+    try:
+        # インクリメンタルデコーダなら4KB境界でマルチバイト文字が
+        # 切れていてもエラーにならない(final=Falseで末尾の不完全列を許容)
+        codecs.getincrementaldecoder('utf-8')().decode(data[:4096], final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        # 国内ブローカーのCSVはShift-JISが多い
+        return 'cp932'
+
+def read_csv_payload(data):
+    """
+    1ファイル分のバイト列をDataFrameに読み込む(ワーカースレッドからも呼ばれる)
+    """
+    # エンコーディングを先に判定して一度だけパースする
+    encoding = detect_encoding(data)
+
+    # 数値カラムはCパーサ内で直接数値化する(カンマ区切り対応、'-'はNaN扱い)
+    # ※engine='pyarrow'はthousands=','非対応のため採用しない
+    #   (このブローカーのCSVは"16,740"形式。pyarrowに切り替えると
+    #    数値化がPythonレベルの後処理に戻ってしまう)
+    csv_kwargs = dict(
+        dtype=defaultdict(lambda: str, {'決済損益': 'float64', '数量': 'float64'}),
+        thousands=',',
+        na_values='-',
+        parse_dates=['約定日時'],
+        date_format='%Y/%m/%d %H:%M'
+    )
+    try:
+        return pd.read_csv(io.BytesIO(data), encoding=encoding, **csv_kwargs)
+    except UnicodeDecodeError:
+        # 先頭4KBだけでは判定しきれなかった場合の保険
+        # (例: 先頭が純ASCIIで後半にShift-JISが現れるファイル)
+        fallback = 'cp932' if encoding != 'cp932' else 'utf-8'
+        return pd.read_csv(io.BytesIO(data), encoding=fallback, **csv_kwargs)
+
+@st.cache_data(show_spinner="CSVを解析中…", max_entries=8)
+def load_and_process_data(file_payloads):
     """
     複数のCSVファイルを読み込み、結合・重複排除してトレードデータを作成する
+
+    st.cache_data でキャッシュするため、引数は (ファイル名, バイト列) のタプルで受け取る。
+    同じアップロード内容なら再実行(月切替など)時はキャッシュが返る。
     """
-    if not files:
+    if not file_payloads:
         return None
 
-    df_list = []
-    
     # 1. 各ファイルを読み込む
-    for file in files:
+    # read_csvはCトークナイザ実行中にGILを解放するので、ファイル単位のスレッド並列が効く
+    with ThreadPoolExecutor(max_workers=min(8, len(file_payloads))) as executor:
+        futures = [(filename, executor.submit(read_csv_payload, data))
+                   for filename, data in file_payloads]
+
+    df_list = []
+    for filename, future in futures:
         try:
-            # ファイル名と読み込み対象の特定
-            if isinstance(file, str):
-                filename = file
-                # パス指定の場合はそのままread_csvに渡せる
-                target = file 
-            else:
-                filename = file.name
-                target = file
-
-            # デフォルト(UTF-8)で試す
-            try:
-                df_temp = pd.read_csv(target, dtype=str)
-            except UnicodeDecodeError:
-                # 失敗したらShift-JISで再試行
-                if not isinstance(file, str):
-                    file.seek(0) # UploadedFileの場合はポインタを戻す
-                df_temp = pd.read_csv(target, dtype=str, encoding='cp932')
-            
-            df_list.append(df_temp)
+            # エラー表示はメインスレッド側で行う(ワーカー内ではst.*を呼ばない)
+            df_list.append(future.result())
         except Exception as e:
             st.error(f"ファイル {filename} の読み込み中にエラーが発生しました: {e}")
             return None
@@ -50,43 +94,65 @@ def load_and_process_data(files):
 
     try:
         # 2. 全データを結合
+        # pandas 3のCopy-on-Writeにより結合時の全カラムコピーは発生しない
+        # (copy=False 指定は3.0でdeprecatedのため付けない)
         df_raw = pd.concat(df_list, ignore_index=True)
 
+        # カーディナリティの小さい文字列カラムはcategoryで持つ
+        # (メモリ削減に加え、区分=='新規'などの比較が整数コード比較になる)
+        for col in ['区分', '通貨ペア', '売買']:
+            if col in df_raw.columns:
+                df_raw[col] = df_raw[col].astype('category')
+
         # 3. 重複排除 (取引番号をキーにする)
         # '取引番号'がない場合はエラー
         if '取引番号' not in df_raw.columns:
             st.error("CSVに'取引番号'カラムが含まれていません。")
             return None
             
+        # キーを数値化しておくと重複排除・マージが整数ハッシュの高速パスに乗る
+        # (数値化できないIDを使うブローカーに備え、全行変換できた場合のみ採用)
+        trade_ids = pd.to_numeric(df_raw['取引番号'], errors='coerce')
+        if not trade_ids.isna().any():
+            df_raw['取引番号'] = trade_ids
+            if '決済対象取引番号' in df_raw.columns:
+                df_raw['決済対象取引番号'] = pd.to_numeric(df_raw['決済対象取引番号'], errors='coerce')
+
         df_raw.drop_duplicates(subset=['取引番号'], keep='first', inplace=True)
 
         # 4. 型変換と前処理
-        # 金額系: カンマを除去して数値化。'-'などの非数値はNaN→0
+        # 金額系はread_csv内で数値化済み。'-'などの非数値はNaN→0。
+        # 併せてダウンキャストしてメモリ帯域を半減する
+        # (float32の有効桁は約7桁=1トレード±1600万円程度まで。超える場合はfloat64に戻す)
         if '決済損益' in df_raw.columns:
-            df_raw['決済損益'] = pd.to_numeric(df_raw['決済損益'].str.replace(',', ''), errors='coerce').fillna(0)
+            df_raw['決済損益'] = pd.to_numeric(df_raw['決済損益'].fillna(0), downcast='float')
         if '数量' in df_raw.columns:
-            df_raw['数量'] = pd.to_numeric(df_raw['数量'].str.replace(',', ''), errors='coerce').fillna(0)
-        
+            df_raw['数量'] = pd.to_numeric(df_raw['数量'].fillna(0), downcast='integer')
+
+
         # 日時変換
-        # 様々なフォーマットに対応できるよう mixed を指定し、エラー時は NaT にする
-        if '約定日時' in df_raw.columns:
+        # 通常は read_csv の parse_dates + date_format (C高速パス)で変換済み。
+        # フォーマットの異なるファイルが混ざって文字列のまま残った場合のみフォールバック
+        if '約定日時' in df_raw.columns and not pd.api.types.is_datetime64_any_dtype(df_raw['約定日時']):
             df_raw['約定日時'] = pd.to_datetime(df_raw['約定日時'], errors='coerce', format='mixed')
-            # 変換できなかった行（NaT）があれば除外するなどの処理が必要だが、今回はそのまま進める
-            # 念のためNaTの行を削除する場合は以下
-            # df_raw.dropna(subset=['約定日時'], inplace=True)
 
-        # 5. 新規と決済に分割
-        df_entry = df_raw[df_raw['区分'] == '新規'].copy()
-        df_exit = df_raw[df_raw['区分'] == '決済'].copy()
+        # 5. 新規と決済に分割 (読み取りのみなのでコピーせずビューで持つ)
+        df_entry = df_raw.loc[df_raw['区分'] == '新規']
+        df_exit = df_raw.loc[df_raw['区分'] == '決済']
+
+        # 下流で使うカラムだけに絞ってからjoinする(コピーされるデータ量を削減)
+        keep_cols = ['取引番号', '決済対象取引番号', '約定日時', '決済損益', '数量', '通貨ペア', '売買']
+        df_entry = df_entry[[c for c in keep_cols if c in df_entry.columns]]
+        df_exit = df_exit[[c for c in keep_cols if c in df_exit.columns]]
 
         # 6. トレードの紐付け (Inner Join)
-        merged_df = pd.merge(
-            df_exit,
-            df_entry,
-            left_on='決済対象取引番号',
-            right_on='取引番号',
-            suffixes=('_exit', '_entry'),
-            how='inner'
+        # 新規側を取引番号でインデックス化し、決済側からのハッシュ参照一発でjoinする
+        merged_df = df_exit.join(
+            df_entry.set_index('取引番号'),
+            on='決済対象取引番号',
+            how='inner',
+            lsuffix='_exit',
+            rsuffix='_entry'
         )
 
         # 7. 計算カラムの作成
@@ -94,7 +160,9 @@ def load_and_process_data(files):
         merged_df['profit'] = merged_df['決済損益_exit'] # 決済行の損益を採用
         
         # 月カラム
-        merged_df['month'] = merged_df['約定日時_exit'].dt.strftime('%Y-%m')
+        # strftimeの行ごと文字列生成を避け、int64ベースのPeriodで持つ
+        # (月フィルタの==比較もC速度になる。表示時はstr()で'2026-01'形式になる)
+        merged_df['month'] = merged_df['約定日時_exit'].dt.to_period('M')
         
         # 表示用に整理
         merged_df['pair'] = merged_df['通貨ペア_entry']
@@ -106,41 +174,55 @@ def load_and_process_data(files):
         st.error(f"データ処理中にエラーが発生しました: {e}")
         return None
 
+@st.cache_data(show_spinner=False)
+def split_by_month(df):
+    """
+    月ごとのDataFrameに分割して辞書で返す
+
+    月切替のたびに全行スキャン(df[df['month']==...])するのを避け、
+    一度のgroupbyでキャッシュしてO(1)のルックアップにする。
+    """
+    return {str(month): group for month, group in df.groupby('month', sort=False)}
+
+@st.cache_data(show_spinner=False)
 def calculate_kpis(df):
     """
     データフレームからKPIを計算する
+
+    dfは約定日時_exit昇順でソート済みであることを前提にする
+    (load_and_process_dataの返り値がそのままソート済み)。
     """
     if len(df) == 0:
         return None
 
+    # 損益はnumpy配列に一度だけ変換し、以降のマスク・集計はその上で行う
+    profit = df['profit'].to_numpy(dtype=np.float64)
+    win_mask = profit > 0
+    loss_mask = profit < 0
+
     # 勝率
-    win_trades = df[df['profit'] > 0]
-    loss_trades = df[df['profit'] < 0]
-    total_trades = len(df)
-    
-    win_rate = (len(win_trades) / total_trades) * 100 if total_trades > 0 else 0
+    win_rate = (win_mask.sum() / len(profit)) * 100
 
     # リスクリワードレシオ
-    avg_profit = win_trades['profit'].mean() if len(win_trades) > 0 else 0
-    avg_loss = loss_trades['profit'].mean() if len(loss_trades) > 0 else 0
-    
+    avg_profit = profit[win_mask].mean() if win_mask.any() else 0
+    avg_loss = profit[loss_mask].mean() if loss_mask.any() else 0
+
     if avg_loss == 0:
         risk_reward = float('inf')
     else:
         risk_reward = avg_profit / abs(avg_loss)
 
-    # 最大ドローダウン
-    df_sorted = df.sort_values('約定日時_exit')
-    cumulative_profit = df_sorted['profit'].cumsum()
-    running_max = cumulative_profit.cummax()
-    drawdown = cumulative_profit - running_max
-    max_drawdown = drawdown.min()
+    # 最大ドローダウン (ソート済み前提なので再ソートしない)
+    # Seriesのcummaxではなくnumpyのaccumulateで1パス計算する
+    cumulative_profit = np.cumsum(profit)
+    running_max = np.maximum.accumulate(cumulative_profit)
+    max_drawdown = float((cumulative_profit - running_max).min())
 
     # 平均保有時間
     avg_holding_time = df['holding_time'].mean()
 
     # 合計損益
-    total_profit = df['profit'].sum()
+    total_profit = profit.sum()
 
     return {
         "win_rate": win_rate,
@@ -150,12 +232,25 @@ def calculate_kpis(df):
         "total_profit": total_profit
     }
 
+# デフォルトパスワード("fx2025")のSHA-256。平文は持たない。
+# 運用時は .streamlit/secrets.toml の password_sha256 で上書きする
+DEFAULT_PASSWORD_SHA256 = "8c8e11bc0f2cb0ebffb977aaf2f40d3231dd090f6bef27312ee3abb2ee00a5ea"
+
+def get_password_digest():
+    """設定済みパスワードのSHA-256ダイジェストを返す"""
+    try:
+        return bytes.fromhex(st.secrets["password_sha256"])
+    except Exception:
+        # secrets.tomlがない、またはキー未設定の場合はデフォルトを使う
+        return bytes.fromhex(DEFAULT_PASSWORD_SHA256)
+
 def check_password():
     """Returns `True` if the user had the correct password."""
 
     def password_entered():
         """Checks whether a password entered by the user is correct."""
-        if st.session_state["password"] == "fx2025": # パスワードはここで設定
+        entered = hashlib.sha256(st.session_state["password"].encode()).digest()
+        if hmac.compare_digest(entered, get_password_digest()):
             st.session_state["password_correct"] = True
             # パスワード入力フィールドをリセットしない（リセットすると再実行で状態が消えることがあるため）
             del st.session_state["password"] 
@@ -185,6 +280,9 @@ def main():
     if not check_password():
         st.stop() # パスワードが通るまで以下の処理を止める
 
+    # plotlyのimportは認証後まで遅延させる(ログイン画面の初回表示を軽くする)
+    import plotly.graph_objects as go
+
     st.sidebar.header("Data Upload")
     
     # 複数ファイル対応: accept_multiple_files=True
@@ -194,22 +292,30 @@ def main():
         accept_multiple_files=True
     )
 
-    target_files = []
+    # キャッシュキーにするため (ファイル名, バイト列) のタプルに揃える
+    file_payloads = ()
     if uploaded_files:
-        target_files = uploaded_files
+        file_payloads = tuple((f.name, f.getvalue()) for f in uploaded_files)
     else:
         # アップロードがない場合はローカル(GitHubリポジトリ内)のCSVを探す
         import glob
         local_files = glob.glob("*.csv")
         if local_files:
             st.sidebar.info(f"保存済みファイルを使用します:\n{local_files}")
-            target_files = local_files
-
-    if target_files:
-        df = load_and_process_data(target_files)
+            payload_list = []
+            for path in local_files:
+                with open(path, 'rb') as f:
+                    payload_list.append((path, f.read()))
+            file_payloads = tuple(payload_list)
+
+    if file_payloads:
+        df = load_and_process_data(file_payloads)
         
         if df is not None and not df.empty:
             # データ期間の表示
+            # strftimeはこのようなスカラー表示(min/max)に限定すること。
+            # 行ごとのstrftimeはPython文字列をN個生成するため、
+            # monthカラム同様 dt.to_period 等のint64表現で持つ
             min_date = df['約定日時_exit'].min()
             max_date = df['約定日時_exit'].max()
             st.sidebar.markdown("---")
@@ -218,11 +324,12 @@ def main():
             st.sidebar.markdown("---")
 
             # サイドバー: 月選択
-            months = sorted(df['month'].unique(), reverse=True)
+            month_groups = split_by_month(df)
+            months = sorted(month_groups, reverse=True)
             selected_month = st.sidebar.selectbox("対象月を選択", months, index=0)
-            
-            # データフィルタリング
-            filtered_df = df[df['month'] == selected_month].copy()
+
+            # データフィルタリング (キャッシュ済みの月別辞書から取り出すだけ)
+            filtered_df = month_groups[selected_month]
             
             # メインエリア表示
             st.title(f"{selected_month} トレード分析")
@@ -257,27 +364,29 @@ def main():
 
                 # グラフエリア
                 st.markdown("### 月次損益推移 (累積)")
-                filtered_df = filtered_df.sort_values('約定日時_exit')
-                filtered_df['cumulative_profit'] = filtered_df['profit'].cumsum()
-
-                fig = px.area(
-                    filtered_df, 
-                    x='約定日時_exit', 
-                    y='cumulative_profit',
-                    labels={'約定日時_exit': '日時', 'cumulative_profit': '累積損益'},
-                    markers=True
+                # load_and_process_dataの時点で約定日時_exit昇順なので再ソートは不要。
+                # plotlyへはSeriesではなくnumpy配列を直接渡す(エンコードが速い)
+                profit_arr = filtered_df['profit'].to_numpy()
+
+                # SVG描画のpx.areaではなくWebGL描画のScatterglを使う
+                # (トレード数が多い月でもDOMノードが増えず描画が軽い)
+                fig = go.Figure(
+                    go.Scattergl(
+                        x=filtered_df['約定日時_exit'].to_numpy(),
+                        y=np.cumsum(profit_arr),
+                        mode='lines+markers',
+                        fill='tozeroy',
+                        customdata=profit_arr,
+                        hovertemplate='<b>日時</b>: %{x}<br><b>累積損益</b>: ¥%{y:,.0f}<br><b>損益</b>: ¥%{customdata:,.0f}'
+                    )
                 )
+                fig.update_layout(xaxis_title='日時', yaxis_title='累積損益')
                 fig.add_hline(y=0, line_dash="dash", line_color="gray")
-                fig.update_traces(
-                    hovertemplate='<b>日時</b>: %{x}<br><b>累積損益</b>: ¥%{y:,.0f}<br><b>損益</b>: ¥%{customdata:,.0f}',
-                    customdata=filtered_df['profit']
-                )
                 st.plotly_chart(fig, use_container_width=True)
 
                 # データテーブル
                 st.markdown("### トレード一覧")
-                table_df = filtered_df.copy()
-                table_df['数量'] = table_df['数量_exit']
+                table_df = filtered_df.assign(数量=filtered_df['数量_exit'])
                 
                 column_config = {
                     '約定日時_exit': '決済日時',
@@ -292,13 +401,16 @@ def main():
                 final_table = table_df[['約定日時_exit', '約定日時_entry', 'holding_time', 'pair', 'side', '数量', 'profit']]
                 final_table.columns = [column_config[c] for c in final_table.columns]
 
-                def color_profit(val):
-                    color = '#d4edda' if val > 0 else '#f8d7da' if val < 0 else ''
-                    text_color = '#155724' if val > 0 else '#721c24' if val < 0 else ''
-                    return f'background-color: {color}; color: {text_color}'
+                def color_profit(col):
+                    # セルごとのPython呼び出し(.map)を避け、列単位でまとめてCSSを生成する
+                    vals = col.to_numpy()
+                    return np.where(
+                        vals > 0, 'background-color: #d4edda; color: #155724',
+                        np.where(vals < 0, 'background-color: #f8d7da; color: #721c24', '')
+                    )
 
                 st.dataframe(
-                    final_table.style.map(color_profit, subset=['損益'])
+                    final_table.style.apply(color_profit, subset=['損益'])
                                      .format({'損益': '¥{:,.0f}', '数量': '{:,.0f}'}),
                     use_container_width=True,
                     hide_index=True